@@ -1,11 +1,14 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 import plotly.express as px
 import plotly.graph_objects as go
-from datetime import datetime, timedelta
-import pytz
-from supabase import create_client, Client
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
+from supabase_client import get_supabase
+from postgrest.exceptions import APIError
 import os
+import time
 from product_processor import extract_line_items_from_orders, get_top_products, format_product_table
 
 # Configuración de la página
@@ -17,7 +20,7 @@ st.set_page_config(
 )
 
 # Timezone de México
-MEXICO_TZ = pytz.timezone('America/Mexico_City')
+MEXICO_TZ = ZoneInfo('America/Mexico_City')
 
 # Colores por canal
 CHANNEL_COLORS = {
@@ -28,72 +31,281 @@ CHANNEL_COLORS = {
     'Otro': '#CCCCCC'
 }
 
-@st.cache_resource
-def init_supabase():
-    """Inicializar cliente de Supabase"""
-    url = st.secrets["SUPABASE_URL"]
-    key = st.secrets["SUPABASE_KEY"]
-    return create_client(url, key)
+# Canales conocidos; el orden define los códigos de la columna categórica 'channel'
+CHANNELS = list(CHANNEL_COLORS)
+CHANNEL_COLOR_CODES = np.array([CHANNEL_COLORS[ch] for ch in CHANNELS])
+
+# Color de línea y relleno (20% de opacidad) de las gráficas de tendencia
+TREND_COLOR_DEFAULT = '#1f77b4'
+CHANNEL_FILL = {
+    ch: f'rgba({int(color[1:3], 16)},{int(color[3:5], 16)},{int(color[5:7], 16)},0.2)'
+    for ch, color in CHANNEL_COLORS.items()
+}
+CHANNEL_FILL_DEFAULT = 'rgba(31,119,180,0.2)'
+
+# Filas pedidas por request (max-rows por defecto de Supabase; uno menor también funciona)
+SUPABASE_PAGE_SIZE = 1000
+
+# Segundos que se cachea el día en curso (los días recientes usan el TTL de load_orders_day)
+TODAY_REFRESH_SECONDS = 60
+
+# Columnas de orders_final que usa el dashboard
+ORDER_COLUMNS = ['id', 'processed_at', 'created_at', 'channel_tags', 'total_price', 'line_items']
 
 def get_mexico_now():
     """Obtener hora actual en timezone de México"""
     return datetime.now(MEXICO_TZ)
 
+def fetch_all_rows(build_query):
+    """Leer todas las filas de una consulta paginando con .range()"""
+    rows = []
+    offset = 0
+    
+    while True:
+        # build_query crea la consulta de nuevo en cada página
+        response = build_query()\
+            .range(offset, offset + SUPABASE_PAGE_SIZE - 1)\
+            .execute()
+        
+        # Si max-rows del proyecto es menor que SUPABASE_PAGE_SIZE, las páginas llegan
+        # más cortas; solo una página vacía indica que ya no hay filas
+        if not response.data:
+            break
+        
+        rows.extend(response.data)
+        offset += len(response.data)
+    
+    return rows
+
+def to_channel_category(channel_tags):
+    """Limpiar nombres de canal y convertirlos a categoría (canales desconocidos = 'Otro')"""
+    channel = channel_tags.fillna('Otro').str.strip()
+    channel = channel.where(channel.isin(CHANNELS), 'Otro')
+    return pd.Categorical(channel, categories=CHANNELS)
+
+def slice_by_date(df, start_date, end_date):
+    """Obtener filas entre dos fechas (inclusive) de un DataFrame ordenado por 'date'"""
+    dates = df['date'].values
+    lo = np.searchsorted(dates, np.datetime64(pd.Timestamp(start_date)), side='left')
+    hi = np.searchsorted(dates, np.datetime64(pd.Timestamp(end_date)), side='right')
+    return df.iloc[lo:hi]
+
+def get_refresh_key(day, today):
+    """Llave extra de caché: solo el día en curso cambia cada TODAY_REFRESH_SECONDS"""
+    if day == today:
+        return int(time.time() // TODAY_REFRESH_SECONDS)
+    return 0
+
 def get_date_range_filters(start_date, end_date):
     """Convertir fechas a timestamps para filtros"""
     # Inicio del día en México
-    start_datetime = datetime.combine(start_date, datetime.min.time())
-    start_datetime = MEXICO_TZ.localize(start_datetime)
+    start_datetime = datetime.combine(start_date, datetime.min.time(), tzinfo=MEXICO_TZ)
     
     # Fin del día en México (23:59:59.999999)
-    end_datetime = datetime.combine(end_date, datetime.max.time())
-    end_datetime = MEXICO_TZ.localize(end_datetime)
+    end_datetime = datetime.combine(end_date, datetime.max.time(), tzinfo=MEXICO_TZ)
     
     # Convertir a UTC para la consulta (Supabase guarda en UTC)
-    start_utc = start_datetime.astimezone(pytz.UTC)
-    end_utc = end_datetime.astimezone(pytz.UTC)
+    start_utc = start_datetime.astimezone(timezone.utc)
+    end_utc = end_datetime.astimezone(timezone.utc)
     
     return start_utc.isoformat(), end_utc.isoformat()
 
-@st.cache_data(ttl=300)
-def load_orders_data(start_date_iso, end_date_iso):
-    """Cargar datos de órdenes desde Supabase"""
-    supabase = init_supabase()
+def fetch_orders_day(day_iso):
+    """Descargar órdenes de un día (horario de México) desde Supabase"""
+    supabase = get_supabase()
     
-    response = supabase.table('orders_final')\
-        .select('*')\
-        .gte('processed_at', start_date_iso)\
-        .lte('processed_at', end_date_iso)\
-        .execute()
+    day = datetime.fromisoformat(day_iso).date()
+    start_date_iso, end_date_iso = get_date_range_filters(day, day)
     
-    df = pd.DataFrame(response.data)
+    # Orden estable para que las páginas no se traslapen
+    rows = fetch_all_rows(lambda: supabase.table('orders_final')
+        .select(','.join(ORDER_COLUMNS))
+        .gte('processed_at', start_date_iso)
+        .lte('processed_at', end_date_iso)
+        .order('processed_at')
+        .order('id'))
+    
+    df = pd.DataFrame.from_records(rows, columns=ORDER_COLUMNS)
     
     if not df.empty:
         # Convertir fechas a timezone de México
-        # Primero localizar a UTC (timezone de Supabase) y luego convertir a México
-        df['processed_at'] = pd.to_datetime(df['processed_at']).dt.tz_localize('UTC').dt.tz_convert(MEXICO_TZ)
-        df['created_at'] = pd.to_datetime(df['created_at']).dt.tz_localize('UTC').dt.tz_convert(MEXICO_TZ)
+        # utc=True interpreta las fechas como UTC (timezone de Supabase) en una sola pasada
+        df['processed_at'] = pd.to_datetime(df['processed_at'], utc=True, format='ISO8601').dt.tz_convert(MEXICO_TZ)
+        df['created_at'] = pd.to_datetime(df['created_at'], utc=True, format='ISO8601').dt.tz_convert(MEXICO_TZ)
         
-        # Crear columna de fecha (sin hora)
-        df['date'] = df['processed_at'].dt.date
+        # Crear columna de fecha (sin hora) como datetime64 para comparaciones vectorizadas
+        df['date'] = df['processed_at'].dt.tz_localize(None).dt.normalize()
         
         # Limpiar nombres de canal
-        df['channel'] = df['channel_tags'].fillna('Otro').str.strip()
+        df['channel'] = to_channel_category(df['channel_tags'])
         
         # Asegurar que total_price es numérico
         df['total_price'] = pd.to_numeric(df['total_price'], errors='coerce').fillna(0)
+        
+        # Ordenar una sola vez para filtrar por fecha con slice_by_date
+        df = df.sort_values('processed_at', kind='mergesort', ignore_index=True)
     
     return df
 
+# Entradas en memoria de load_orders_day: hoy rota de llave cada minuto y el TTL
+# las expira a los 5 minutos; max_entries acota la memoria en sesiones largas
+ORDERS_DAY_CACHE_ENTRIES = 16
+
+@st.cache_data(ttl=300, max_entries=ORDERS_DAY_CACHE_ENTRIES)
+def load_orders_day(day_iso, refresh_key=0):
+    """Cargar órdenes de hoy o de un día reciente (caché en memoria con TTL)"""
+    return fetch_orders_day(day_iso)
+
+# Días cerrados que se guardan en disco; persist="disk" ignora el TTL,
+# así que solo se usa para días que ya no cambian ("Refrescar Datos" también los limpia)
+ORDERS_DISK_CACHE_ENTRIES = 400
+
+# Días recientes (además de hoy) que siguen en el caché con TTL: la sincronización
+# puede escribir órdenes tarde o editarlas después del primer fetch
+ORDERS_GRACE_DAYS = 1
+
+@st.cache_data(persist="disk", max_entries=ORDERS_DISK_CACHE_ENTRIES)
+def load_past_orders_day(day_iso):
+    """Cargar órdenes de un día anterior (caché en disco, sobrevive reinicios de la app)"""
+    return fetch_orders_day(day_iso)
+
+def load_orders_data(start_date, end_date, today):
+    """Cargar órdenes de un rango de fechas reutilizando el caché de cada día"""
+    frames = []
+    closed_before = today - timedelta(days=ORDERS_GRACE_DAYS)
+    for day in pd.date_range(start_date, end_date, freq='D'):
+        day_iso = day.strftime('%Y-%m-%d')
+        if day.date() < closed_before:
+            day_df = load_past_orders_day(day_iso)
+        else:
+            # Hoy y los días de gracia se refrescan con el TTL; hoy además cambia de llave cada minuto
+            day_df = load_orders_day(day_iso, get_refresh_key(day.date(), today))
+        if not day_df.empty:
+            frames.append(day_df)
+    
+    if not frames:
+        return pd.DataFrame()
+    
+    # Cada día ya viene ordenado, así que el resultado sigue ordenado por fecha
+    return pd.concat(frames, ignore_index=True)
+
 @st.cache_data(ttl=300)
-def load_line_items_data(start_date_iso, end_date_iso):
-    """Cargar datos de líneas de productos (si existe tabla separada)"""
+def load_daily_channel_sales(start_date, end_date):
+    """Cargar ventas agregadas por día y canal desde la vista orders_daily_channel"""
+    supabase = get_supabase()
+    
+    # Una fila por (día, canal) en lugar de una por orden
+    rows = fetch_all_rows(lambda: supabase.table('orders_daily_channel')
+        .select('day,channel,sales,orders')
+        .gte('day', start_date.isoformat())
+        .lte('day', end_date.isoformat())
+        .order('day')
+        .order('channel'))
+    
+    df = pd.DataFrame.from_records(rows, columns=['day', 'channel', 'sales', 'orders'])
+    
+    if not df.empty:
+        # La vista ya agrupa por día en timezone de México
+        df['date'] = pd.to_datetime(df['day'])
+        df['channel'] = to_channel_category(df['channel'])
+        df['sales'] = pd.to_numeric(df['sales'], errors='coerce').fillna(0)
+        df['orders'] = pd.to_numeric(df['orders'], errors='coerce').fillna(0).astype(int)
+        
+        # Ordenar una sola vez para filtrar por fecha con slice_by_date
+        df = df.sort_values('date', kind='mergesort', ignore_index=True)
+    
+    return df
+
+def aggregate_daily_channel_sales(start_date, end_date, today):
+    """Agregar por día y canal las órdenes descargadas (respaldo si la vista orders_daily_channel no existe)"""
+    orders_df = load_orders_data(start_date, end_date, today)
+    
+    if orders_df.empty:
+        return pd.DataFrame()
+    
+    # Mismas columnas que load_daily_channel_sales, ya ordenadas por fecha y canal
+    df = orders_df.groupby(['date', 'channel'], observed=True, sort=True).agg(
+        sales=('total_price', 'sum'),
+        orders=('id', 'size')
+    ).reset_index()
+    df['day'] = df['date'].dt.date
+    
+    return df[['day', 'channel', 'sales', 'orders', 'date']]
+
+# Productos: una entrada por rango de fechas (y top N); max_entries limita la memoria
+PRODUCTS_CACHE_ENTRIES = 32
+
+# Segundos que la sesión deja de llamar a get_top_products después de un error
+RPC_RETRY_SECONDS = 300
+
+# Segundos que la sesión reutiliza el ranking de productos (mismo TTL que los cachés de productos)
+TOP_PRODUCTS_SESSION_SECONDS = 300
+
+@st.cache_data(ttl=300, max_entries=PRODUCTS_CACHE_ENTRIES, show_spinner=False)
+def load_line_items_data(start_date, end_date, today, refresh_key=0):
+    """Cargar líneas de productos de un rango de fechas; regresa (núm. de órdenes, items)"""
     # Por ahora, extraeremos productos del JSON en orders_final
     # Si tienes una tabla line_items separada, cambiar esta función
-    return pd.DataFrame()
+    df = load_orders_data(start_date, end_date, today)
+    return len(df), extract_line_items_from_orders(df)
 
-def calculate_kpis(df, period_start, period_end):
-    """Calcular KPIs principales"""
+@st.cache_data(ttl=300, max_entries=PRODUCTS_CACHE_ENTRIES, show_spinner=False)
+def load_top_products(start_date, end_date, top_n, today, refresh_key=0):
+    """Obtener resumen y ranking de productos de un rango de fechas procesando los line_items en pandas"""
+    num_orders, items_df = load_line_items_data(start_date, end_date, today, refresh_key)
+    
+    if items_df.empty:
+        summary = {'num_orders': num_orders, 'num_items': 0, 'total_units': 0, 'total_revenue': 0, 'unique_skus': 0}
+        return summary, pd.DataFrame()
+    
+    summary = {
+        'num_orders': num_orders,
+        'num_items': len(items_df),
+        'total_units': int(items_df['quantity'].sum()),
+        'total_revenue': items_df['line_total'].sum(),
+        'unique_skus': items_df['sku'].nunique()
+    }
+    return summary, get_top_products(items_df, top_n=top_n)
+
+@st.cache_data(ttl=300, max_entries=PRODUCTS_CACHE_ENTRIES, show_spinner=False)
+def load_top_products_rpc(start_date, end_date, top_n, refresh_key=0):
+    """Obtener resumen y ranking de productos con la función get_top_products de Postgres"""
+    supabase = get_supabase()
+    start_ts, end_ts = get_date_range_filters(start_date, end_date)
+    
+    # Los errores se propagan: st.cache_data no cachea excepciones, así que un fallo no queda memorizado
+    response = supabase.rpc('get_top_products', {
+        'start_ts': start_ts,
+        'end_ts': end_ts,
+        'top_n': int(top_n)
+    }).execute()
+    
+    # La función siempre regresa una fila con los totales; sin productos, esa fila trae sku en null
+    rows = pd.DataFrame(response.data)
+    totals = rows.iloc[0]
+    summary = {
+        'num_orders': int(totals['total_orders']),
+        'num_items': int(totals['total_items']),
+        'total_units': int(totals['total_units']),
+        'total_revenue': float(totals['total_revenue']),
+        'unique_skus': int(totals['unique_skus'])
+    }
+    rows = rows[rows['sku'].notna()].reset_index(drop=True)
+    
+    # Mismas columnas que get_top_products
+    top_products = pd.DataFrame({
+        'SKU': rows['sku'],
+        'Producto': rows['name'],
+        'Unidades': rows['units'].astype(np.int64),
+        'Ventas (MXN)': pd.to_numeric(rows['revenue'], errors='coerce'),
+        '% del Total': pd.to_numeric(rows['pct_total'], errors='coerce')
+    })
+    top_products.index = top_products.index + 1  # Ranking empieza en 1
+    
+    return summary, top_products
+
+def calculate_kpis(df):
+    """Calcular KPIs principales de un período de ventas agregadas por día y canal"""
     if df.empty:
         return {
             'ventas_total': 0,
@@ -101,12 +313,8 @@ def calculate_kpis(df, period_start, period_end):
             'ticket_promedio': 0
         }
     
-    # Filtrar por período
-    mask = (df['date'] >= period_start) & (df['date'] <= period_end)
-    period_df = df[mask]
-    
-    ventas_total = period_df['total_price'].sum()
-    num_ordenes = len(period_df)
+    ventas_total = df['sales'].sum()
+    num_ordenes = int(df['orders'].sum())
     ticket_promedio = ventas_total / num_ordenes if num_ordenes > 0 else 0
     
     return {
@@ -119,14 +327,20 @@ def format_currency(amount):
     """Formatear cantidad como moneda MXN"""
     return f"${amount:,.2f} MXN"
 
-def create_channel_bar_chart(df, title):
-    """Crear gráfica de barras por canal"""
-    if df.empty:
+def format_currency_list(amounts):
+    """Formatear un arreglo de cantidades como moneda MXN en una sola pasada"""
+    return ('$' + pd.Series(amounts).map('{:,.2f}'.format) + ' MXN').tolist()
+
+@st.cache_data(ttl=300, show_spinner=False)
+def create_channel_bar_chart(channel_sales, title):
+    """Crear gráfica de barras a partir de ventas ya agregadas por canal"""
+    if channel_sales.empty:
         return go.Figure()
     
-    channel_sales = df.groupby('channel')['total_price'].sum().sort_values(ascending=False)
+    channel_sales = channel_sales.sort_values(ascending=False)
     
-    colors = [CHANNEL_COLORS.get(ch, CHANNEL_COLORS['Otro']) for ch in channel_sales.index]
+    # El índice es categórico: los códigos indexan directo el arreglo de colores
+    colors = CHANNEL_COLOR_CODES[channel_sales.index.codes]
     
     fig = go.Figure(data=[
         go.Bar(
@@ -134,7 +348,7 @@ def create_channel_bar_chart(df, title):
             x=channel_sales.values,
             orientation='h',
             marker_color=colors,
-            text=[format_currency(v) for v in channel_sales.values],
+            text=format_currency_list(channel_sales.values),
             textposition='auto',
         )
     ])
@@ -149,28 +363,24 @@ def create_channel_bar_chart(df, title):
     
     return fig
 
-def create_daily_trend_chart(df, title, channel=None):
-    """Crear gráfica de tendencia diaria"""
-    if df.empty:
-        return go.Figure()
-    
-    if channel:
-        df = df[df['channel'] == channel]
+@st.cache_data(ttl=300, show_spinner=False)
+def create_daily_trend_chart(daily_sales, title, channel=None):
+    """Crear gráfica de tendencia a partir de ventas ya agregadas por día"""
+    # Sin ventas se dibuja una traza vacía, pero con el título y layout del canal
+    daily_sales = daily_sales.sort_index()
     
-    daily_sales = df.groupby('date')['total_price'].sum().reset_index()
-    daily_sales = daily_sales.sort_values('date')
-    
-    color = CHANNEL_COLORS.get(channel, '#1f77b4') if channel else '#1f77b4'
+    color = CHANNEL_COLORS.get(channel, TREND_COLOR_DEFAULT)
+    fillcolor = CHANNEL_FILL.get(channel, CHANNEL_FILL_DEFAULT)
     
     fig = go.Figure(data=[
         go.Scatter(
-            x=daily_sales['date'],
-            y=daily_sales['total_price'],
+            x=daily_sales.index,
+            y=daily_sales.values,
             mode='lines+markers',
             line=dict(color=color, width=3),
             marker=dict(size=8),
             fill='tozeroy',
-            fillcolor=f'rgba{tuple(list(int(color.lstrip("#")[i:i+2], 16) for i in (0, 2, 4)) + [0.2])}'
+            fillcolor=fillcolor
         )
     ])
     
@@ -184,34 +394,40 @@ def create_daily_trend_chart(df, title, channel=None):
     
     return fig
 
-def show_overview_tab(df, selected_start, selected_end):
+def show_overview_tab(df, selected_start, selected_end, now):
     """Mostrar pestaña de overview con métricas"""
     st.header("📊 Overview de Ventas")
     
     # Obtener fechas de hoy y del mes actual
-    now = get_mexico_now()
-    today = now.date()
+    today = pd.Timestamp(now.date())
     first_day_month = today.replace(day=1)
     
+    # Filtrar una sola vez los datos de hoy y del mes
+    today_df = slice_by_date(df, today, today)
+    month_df = slice_by_date(df, first_day_month, today)
+    
+    # Tabla única (día x canal) del mes; las gráficas se derivan de ella
+    month_sales = month_df.pivot(index='date', columns='channel', values='sales')
+    
     # Debug info (colapsable)
     with st.expander("🔍 Información de Depuración", expanded=False):
         st.write(f"**Fecha/hora actual (México):** {now.strftime('%Y-%m-%d %H:%M:%S %Z')}")
-        st.write(f"**Fecha de 'hoy':** {today}")
-        st.write(f"**Total órdenes cargadas:** {len(df)}")
+        st.write(f"**Fecha de 'hoy':** {today.date()}")
+        st.write(f"**Total órdenes cargadas:** {df['orders'].sum()}")
         if not df.empty:
-            st.write(f"**Rango de fechas en datos:** {df['date'].min()} a {df['date'].max()}")
-            st.write(f"**Órdenes con fecha = hoy:** {len(df[df['date'] == today])}")
-            st.write(f"**Órdenes del mes:** {len(df[(df['date'] >= first_day_month) & (df['date'] <= today)])}")
+            st.write(f"**Rango de fechas en datos:** {df['date'].min().date()} a {df['date'].max().date()}")
+            st.write(f"**Órdenes con fecha = hoy:** {today_df['orders'].sum()}")
+            st.write(f"**Órdenes del mes:** {month_df['orders'].sum()}")
             
             # Mostrar distribución de fechas
-            date_counts = df['date'].value_counts().sort_index().tail(7)
+            date_counts = df.groupby('date')['orders'].sum().tail(7)
             st.write("**Últimas 7 fechas con órdenes:**")
             for date, count in date_counts.items():
-                st.write(f"  - {date}: {count} órdenes")
+                st.write(f"  - {date.date()}: {count} órdenes")
     
     # Calcular KPIs
-    kpis_today = calculate_kpis(df, today, today)
-    kpis_month = calculate_kpis(df, first_day_month, today)
+    kpis_today = calculate_kpis(today_df)
+    kpis_month = calculate_kpis(month_df)
     
     # Sección 1: KPIs Cards
     st.subheader("Métricas Principales")
@@ -264,15 +480,13 @@ def show_overview_tab(df, selected_start, selected_end):
     col1, col2 = st.columns(2)
     
     with col1:
-        # Filtrar datos de hoy
-        today_df = df[df['date'] == today]
-        fig_today = create_channel_bar_chart(today_df, "Ventas de Hoy por Canal")
+        # La vista tiene una fila por canal y día
+        today_sales = today_df.set_index('channel')['sales']
+        fig_today = create_channel_bar_chart(today_sales, "Ventas de Hoy por Canal")
         st.plotly_chart(fig_today, use_container_width=True, key="chart_today_channel")
     
     with col2:
-        # Filtrar datos del mes
-        month_df = df[(df['date'] >= first_day_month) & (df['date'] <= today)]
-        fig_month = create_channel_bar_chart(month_df, "Ventas del Mes por Canal")
+        fig_month = create_channel_bar_chart(month_sales.sum(), "Ventas del Mes por Canal")
         st.plotly_chart(fig_month, use_container_width=True, key="chart_month_channel")
     
     st.divider()
@@ -281,23 +495,27 @@ def show_overview_tab(df, selected_start, selected_end):
     st.subheader("Tendencias de Ventas")
     
     # Gráfica grande: Total del mes
-    month_df = df[(df['date'] >= first_day_month) & (df['date'] <= today)]
-    fig_total = create_daily_trend_chart(month_df, "Ventas Diarias del Mes - Total")
+    fig_total = create_daily_trend_chart(month_sales.sum(axis=1), "Ventas Diarias del Mes - Total")
     st.plotly_chart(fig_total, use_container_width=True, key="chart_total_trend")
     
     # Gráficas pequeñas por canal
     st.subheader("Tendencias por Canal")
     
-    channels = ['Amazon', 'Mercado Libre', 'Shopify', 'TikTok']
+    channels = [ch for ch in CHANNELS if ch != 'Otro']
     
     col1, col2 = st.columns(2)
     
     for idx, channel in enumerate(channels):
         with col1 if idx % 2 == 0 else col2:
-            fig_channel = create_daily_trend_chart(month_df, f"{channel}", channel)
+            # Solo los días con ventas en el canal
+            if channel in month_sales.columns:
+                channel_daily = month_sales[channel].dropna()
+            else:
+                channel_daily = pd.Series(dtype=float)
+            fig_channel = create_daily_trend_chart(channel_daily, f"{channel}", channel)
             st.plotly_chart(fig_channel, use_container_width=True, key=f"chart_trend_{channel.lower().replace(' ', '_')}")
 
-def show_top_products_tab(df):
+def show_top_products_tab(selected_start, selected_end, now):
     """Mostrar pestaña de top productos"""
     st.header("🏆 Top Productos")
     
@@ -321,8 +539,7 @@ def show_top_products_tab(df):
         )
     
     # Calcular fechas según período
-    now = get_mexico_now()
-    today = now.date()
+    today = pd.Timestamp(now.date())
     
     if period == "Mes Actual":
         start_date = today.replace(day=1)
@@ -331,31 +548,58 @@ def show_top_products_tab(df):
         start_date = today.replace(month=1, day=1)
         end_date = today
     
-    # Filtrar datos por período
-    period_df = df[(df['date'] >= start_date) & (df['date'] <= end_date)].copy()
+    # El período se limita al rango de fechas del sidebar
+    range_start = max(start_date, pd.Timestamp(selected_start)).date()
+    range_end = min(end_date, pd.Timestamp(selected_end)).date()
     
-    if period_df.empty:
+    if range_start > range_end:
         st.warning("No hay datos para el período seleccionado")
         return
     
-    # Mostrar resumen del período
-    st.caption(f"📅 Período: {start_date.strftime('%d/%m/%Y')} - {end_date.strftime('%d/%m/%Y')}")
-    st.caption(f"📦 Total de órdenes: {len(period_df):,}")
+    # Los resultados se cachean por rango de fechas, no por el DataFrame de órdenes
+    refresh_key = get_refresh_key(range_end, now.date())
     
     # Procesar line items
     with st.spinner("Procesando productos..."):
         try:
-            # Extraer line items
-            items_df = extract_line_items_from_orders(period_df)
+            # Al volver a la pestaña con el mismo rango se reutiliza el resultado de la sesión
+            # sin pasar por el hash de argumentos de st.cache_data; la llave cambia cada
+            # TOP_PRODUCTS_SESSION_SECONDS para que los días recientes también se refresquen
+            session_bucket = int(time.time() // TOP_PRODUCTS_SESSION_SECONDS)
+            top_key = (range_start.isoformat(), range_end.isoformat(), top_n, refresh_key, session_bucket)
+            if st.session_state.get('top_products_key') == top_key:
+                result = st.session_state['top_products_result']
+            else:
+                # Agregar en Postgres; si la función no existe o falla, extraer line items en pandas.
+                # Tras un error no se vuelve a llamar durante RPC_RETRY_SECONDS
+                result = None
+                if time.time() >= st.session_state.get('top_products_rpc_retry_at', 0):
+                    try:
+                        result = load_top_products_rpc(range_start, range_end, top_n, refresh_key)
+                    except APIError as e:
+                        st.session_state['top_products_rpc_retry_at'] = time.time() + RPC_RETRY_SECONDS
+                        st.caption(f"⚠️ get_top_products no disponible ({e.message}); productos calculados desde las órdenes")
+                
+                if result is None:
+                    result = load_top_products(range_start, range_end, top_n, now.date(), refresh_key)
+                
+                st.session_state['top_products_key'] = top_key
+                st.session_state['top_products_result'] = result
+            summary, top_products = result
+            
+            if summary['num_orders'] == 0:
+                st.warning("No hay datos para el período seleccionado")
+                return
             
-            if items_df.empty:
+            # Mostrar resumen del período
+            st.caption(f"📅 Período: {start_date.strftime('%d/%m/%Y')} - {end_date.strftime('%d/%m/%Y')}")
+            st.caption(f"📦 Total de órdenes: {summary['num_orders']:,}")
+            
+            if summary['num_items'] == 0:
                 st.warning("⚠️ No se pudieron extraer productos de las órdenes. Verifica que la columna 'line_items' contenga datos válidos.")
                 st.info("**Nota**: La columna 'line_items' debe contener JSON con la información de productos de cada orden.")
                 return
             
-            # Obtener top productos
-            top_products = get_top_products(items_df, top_n=top_n)
-            
             if top_products.empty:
                 st.warning("No se encontraron productos en el período seleccionado")
                 return
@@ -364,27 +608,21 @@ def show_top_products_tab(df):
             col1, col2, col3 = st.columns(3)
             
             with col1:
-                total_units = items_df['quantity'].sum()
-                st.metric("🔢 Total Unidades Vendidas", f"{int(total_units):,}")
+                st.metric("🔢 Total Unidades Vendidas", f"{summary['total_units']:,}")
             
             with col2:
-                total_revenue = items_df['line_total'].sum()
-                st.metric("💰 Ventas Totales", format_currency(total_revenue))
+                st.metric("💰 Ventas Totales", format_currency(summary['total_revenue']))
             
             with col3:
-                unique_products = items_df['sku'].nunique()
-                st.metric("📦 SKUs Únicos", f"{unique_products:,}")
+                st.metric("📦 SKUs Únicos", f"{summary['unique_skus']:,}")
             
             st.divider()
             
             # Mostrar tabla de top productos
             st.subheader(f"Top {top_n} Productos - {period}")
             
-            # Formatear para display
-            display_df = format_product_table(top_products.copy())
-            
-            # Agregar columna de ranking
-            display_df.insert(0, '#', range(1, len(display_df) + 1))
+            # Preparar para display (el formato lo aplica column_config)
+            display_df = format_product_table(top_products)
             
             # Mostrar tabla
             st.dataframe(
@@ -407,20 +645,23 @@ def show_top_products_tab(df):
                         help="Nombre o descripción del producto",
                         width="large"
                     ),
-                    "Unidades": st.column_config.TextColumn(
+                    "Unidades": st.column_config.NumberColumn(
                         "Unidades",
                         help="Total de unidades vendidas",
-                        width="small"
+                        width="small",
+                        format="%,d"
                     ),
-                    "Ventas (MXN)": st.column_config.TextColumn(
+                    "Ventas (MXN)": st.column_config.NumberColumn(
                         "Ventas Totales",
                         help="Ingresos totales generados",
-                        width="medium"
+                        width="medium",
+                        format="$%,.2f MXN"
                     ),
-                    "% del Total": st.column_config.TextColumn(
+                    "% del Total": st.column_config.NumberColumn(
                         "% Total",
                         help="Porcentaje del total de ventas",
-                        width="small"
+                        width="small",
+                        format="%.1f%%"
                     )
                 }
             )
@@ -428,20 +669,16 @@ def show_top_products_tab(df):
             # Gráfica de top 10
             st.subheader("Top 10 Productos - Visualización")
             
-            top_10 = top_products.head(10).copy()
             # Revertir orden para que el #1 esté arriba en horizontal bar
-            top_10 = top_10.iloc[::-1]
-            
-            # Convertir ventas a numérico si está como string
-            if top_10['Ventas (MXN)'].dtype == 'object':
-                top_10['Ventas (MXN)'] = top_10['Ventas (MXN)'].str.replace('$', '').str.replace(',', '').astype(float)
+            # (top_products conserva las columnas numéricas; solo display_df tiene texto)
+            top_10 = top_products.head(10).iloc[::-1]
             
             fig = go.Figure(data=[
                 go.Bar(
                     y=top_10['Producto'],
                     x=top_10['Ventas (MXN)'],
                     orientation='h',
-                    text=[format_currency(v) for v in top_10['Ventas (MXN)']],
+                    text=format_currency_list(top_10['Ventas (MXN)'].values),
                     textposition='auto',
                     marker_color='#FF6B6B'
                 )
@@ -464,13 +701,15 @@ def show_top_products_tab(df):
 def main():
     """Función principal de la aplicación"""
     
+    # Hora de México calculada una sola vez por ejecución; se pasa a cada sección
+    now = get_mexico_now()
+    today = now.date()
+    
     # Sidebar con filtros
     with st.sidebar:
         st.title("🎛️ Filtros")
         
         # Selector de rango de fechas
-        now = get_mexico_now()
-        today = now.date()
         first_day_month = today.replace(day=1)
         
         st.subheader("Rango de Fechas")
@@ -497,6 +736,8 @@ def main():
         # Botón para refrescar datos
         if st.button("🔄 Refrescar Datos", use_container_width=True):
             st.cache_data.clear()
+            st.session_state.pop('top_products_key', None)
+            st.session_state.pop('top_products_rpc_retry_at', None)
             st.rerun()
     
     # Título principal
@@ -504,21 +745,36 @@ def main():
     
     # Cargar datos
     with st.spinner("Cargando datos..."):
-        start_iso, end_iso = get_date_range_filters(selected_start, selected_end)
-        df = load_orders_data(start_iso, end_iso)
+        try:
+            daily_df = load_daily_channel_sales(selected_start, selected_end)
+            view_error = None
+        except APIError as e:
+            # Sin la vista se agregan las órdenes en pandas (más lento: descarga cada orden)
+            view_error = e
+            daily_df = aggregate_daily_channel_sales(selected_start, selected_end, today)
     
-    if df.empty:
+    if view_error is not None:
+        st.caption(f"⚠️ Vista orders_daily_channel no disponible ({view_error.message}); ventas calculadas desde las órdenes. Ejecuta sql/orders_daily_channel.sql en Supabase")
+    
+    if daily_df.empty:
         st.error("No se encontraron datos para el período seleccionado")
         return
     
-    # Tabs principales
-    tab1, tab2 = st.tabs(["📈 Overview", "🏆 Top Productos"])
-    
-    with tab1:
-        show_overview_tab(df, selected_start, selected_end)
+    # Secciones principales
+    # st.tabs ejecuta el contenido de todas las pestañas en cada rerun;
+    # con el selector solo se calcula la sección activa
+    active_tab = st.radio(
+        "Sección:",
+        ["📈 Overview", "🏆 Top Productos"],
+        horizontal=True,
+        key="active_tab",
+        label_visibility="collapsed"
+    )
     
-    with tab2:
-        show_top_products_tab(df)
+    if active_tab == "📈 Overview":
+        show_overview_tab(daily_df, selected_start, selected_end, now)
+    else:
+        show_top_products_tab(selected_start, selected_end, now)
 
 if __name__ == "__main__":
     main()
@@ -4,7 +4,100 @@ Extrae productos del campo JSON y los agrega al dashboard
 """
 
 import pandas as pd
+import numpy as np
 import json
+import io
+
+# orjson parsea 2-3x más rápido; si no está instalado se usa json de la stdlib
+try:
+    import orjson
+    json_loads = orjson.loads
+except ImportError:
+    json_loads = json.loads
+
+# ijson (opcional) parsea por streaming los line_items muy grandes sin duplicar la memoria
+try:
+    import ijson
+    JSON_ERRORS = (json.JSONDecodeError, ijson.JSONError)
+except ImportError:
+    ijson = None
+    JSON_ERRORS = (json.JSONDecodeError,)
+
+# Texto de sku/name/title en buffers de Arrow; sin pyarrow se usa el dtype string de pandas
+# ITEM_SCHEMA: tipos de los campos de un line item de Shopify (ids y quantity enteros, montos en texto)
+try:
+    import pyarrow as pa
+    STRING_DTYPE = 'string[pyarrow]'
+    ITEM_SCHEMA = pa.struct([
+        ('id', pa.int64()),
+        ('product_id', pa.int64()),
+        ('variant_id', pa.int64()),
+        ('sku', pa.large_string()),
+        ('name', pa.large_string()),
+        ('title', pa.large_string()),
+        ('quantity', pa.int64()),
+        ('price', pa.large_string()),
+        ('total_discount', pa.large_string())
+    ])
+except ImportError:
+    pa = None
+    STRING_DTYPE = 'string'
+    ITEM_SCHEMA = None
+
+# Tamaño (caracteres) a partir del cual un line_items en texto se parsea con ijson;
+# en strings chicos el costo de preparar el parser domina y orjson es más rápido
+STREAM_PARSE_THRESHOLD = 65536
+
+# Campos de cada line item que usa el dashboard
+ITEM_FIELDS = ['id', 'product_id', 'variant_id', 'sku', 'name', 'title', 'quantity', 'price', 'total_discount']
+
+def parse_line_items(value):
+    """
+    Convierte el valor de line_items de una orden en lista de items
+    
+    Args:
+        value: Lista (JSONB ya decodificado) o JSON string
+        
+    Returns:
+        Lista de items, o None si el valor no es válido
+    """
+    
+    if isinstance(value, list):
+        return value
+    
+    if isinstance(value, str):
+        try:
+            if ijson is not None and len(value) >= STREAM_PARSE_THRESHOLD:
+                # Igual que con json_loads: un JSON válido que no es lista regresa None
+                if not value.lstrip().startswith('['):
+                    return None
+                # Los items se generan uno a uno, sin construir antes el árbol JSON completo
+                return list(ijson.items(io.BytesIO(value.encode()), 'item', use_float=True))
+            items = json_loads(value)
+        except JSON_ERRORS:
+            return None
+        return items if isinstance(items, list) else None
+    
+    return None
+
+def build_items_arrow(line_items):
+    """
+    Construye las columnas de los items con pyarrow (la lectura de los dicts corre en C)
+    
+    Args:
+        line_items: Serie con un dict por item
+        
+    Returns:
+        DataFrame con ITEM_FIELDS; lanza ArrowInvalid/ArrowTypeError si algún
+        campo no tiene el tipo de ITEM_SCHEMA, u OverflowError si un entero no cabe en int64
+    """
+    
+    struct = pa.array(line_items.tolist(), type=ITEM_SCHEMA)
+    items = pa.Table.from_struct_array(struct).to_pandas(
+        types_mapper={pa.large_string(): pd.StringDtype('pyarrow')}.get
+    )
+    
+    return items
 
 def extract_line_items_from_orders(df):
     """
@@ -20,45 +113,60 @@ def extract_line_items_from_orders(df):
     if df.empty or 'line_items' not in df.columns:
         return pd.DataFrame()
     
-    all_items = []
+    # Descartar en bloque las órdenes sin line_items antes de cualquier parseo
+    orders = df.loc[df['line_items'].notna(), ['id', 'date', 'channel', 'line_items']]
     
-    for idx, row in df.iterrows():
-        try:
-            # Parsear JSON si es string
-            if isinstance(row['line_items'], str):
-                items = json.loads(row['line_items'])
-            elif isinstance(row['line_items'], list):
-                items = row['line_items']
-            else:
-                continue
-            
-            # Procesar cada item
-            for item in items:
-                product_data = {
-                    'order_id': row['id'],
-                    'order_date': row['date'],
-                    'channel': row['channel'],
-                    'line_item_id': item.get('id'),
-                    'product_id': item.get('product_id'),
-                    'variant_id': item.get('variant_id'),
-                    'sku': item.get('sku', 'N/A'),
-                    'name': item.get('name', 'Sin nombre'),
-                    'title': item.get('title', item.get('name', 'Sin título')),
-                    'quantity': item.get('quantity', 0),
-                    'price': float(item.get('price', 0)),
-                    'total_discount': float(item.get('total_discount', 0)),
-                    'line_total': float(item.get('price', 0)) * item.get('quantity', 0)
-                }
-                all_items.append(product_data)
-        
-        except (json.JSONDecodeError, KeyError, TypeError) as e:
-            # Skip problematic rows
-            continue
+    # Las listas (JSONB) se usan tal cual; solo los strings se parsean y lo demás queda en NaN
+    kinds = orders['line_items'].map(type)
+    is_str = kinds.eq(str)
+    parsed = orders.loc[is_str, 'line_items'].map(parse_line_items)
+    line_items = orders['line_items'].where(kinds.eq(list)).where(~is_str, parsed)
+    orders = orders.assign(line_items=line_items)
     
-    if not all_items:
+    # Una fila por item (las listas vacías y los None quedan como NaN)
+    exploded = orders.explode('line_items', ignore_index=True)
+    exploded = exploded[exploded['line_items'].map(lambda item: isinstance(item, dict))].reset_index(drop=True)
+    
+    if exploded.empty:
         return pd.DataFrame()
     
-    items_df = pd.DataFrame(all_items)
+    # pyarrow convierte todos los dicts en C; si algún campo trae un tipo distinto
+    # al de Shopify (o un entero fuera de int64), el lote completo se construye con el constructor de pandas
+    items = None
+    if ITEM_SCHEMA is not None:
+        try:
+            items = build_items_arrow(exploded['line_items'])
+        except (pa.ArrowInvalid, pa.ArrowTypeError, OverflowError):
+            items = None
+    
+    if items is None:
+        items = pd.DataFrame(exploded['line_items'].tolist(), columns=ITEM_FIELDS)
+    
+    # Valores por defecto: name nulo o vacío, title nulo o vacío toma name
+    items['sku'] = items['sku'].fillna('N/A')
+    items['name'] = items['name'].where(items['name'].notna() & items['name'].ne(''), 'Sin nombre')
+    items['title'] = items['title'].where(items['title'].notna() & items['title'].ne(''), items['name'])
+    items = items.astype({'sku': STRING_DTYPE, 'name': STRING_DTYPE, 'title': STRING_DTYPE})
+    quantity = pd.to_numeric(items['quantity'], errors='coerce').fillna(0)
+    price = pd.to_numeric(items['price'], errors='coerce').fillna(0.0)
+    
+    # line_total se calcula y guarda en float64: es la columna que se suma para los totales
+    # (multiplicación directa de los arreglos de NumPy, sin alinear índices)
+    items['line_total'] = price.to_numpy(dtype=np.float64) * quantity.to_numpy(dtype=np.float64)
+    
+    # Columnas que no se suman: tipos de 32 bits para ocupar la mitad de memoria
+    items['quantity'] = quantity.astype(np.int32)
+    items['price'] = price.astype(np.float32)
+    items['total_discount'] = pd.to_numeric(items['total_discount'], errors='coerce').fillna(0.0).astype(np.float32)
+    
+    items_df = pd.concat([
+        exploded[['id', 'date', 'channel']].rename(columns={
+            'id': 'order_id',
+            'date': 'order_date'
+        }),
+        items.rename(columns={'id': 'line_item_id'})
+    ], axis=1)
+    
     return items_df
 
 def get_top_products(items_df, top_n=20):
@@ -70,51 +178,71 @@ def get_top_products(items_df, top_n=20):
         top_n: Número de productos a retornar
         
     Returns:
-        DataFrame con ranking de productos
+        DataFrame con ranking de productos (columnas numéricas, sin formato)
     """
     
     if items_df.empty:
         return pd.DataFrame()
     
-    # Agrupar por SKU
-    product_summary = items_df.groupby(['sku', 'name']).agg({
-        'quantity': 'sum',
-        'line_total': 'sum'
-    }).reset_index()
-    
-    # Ordenar por ventas totales
-    product_summary = product_summary.sort_values('line_total', ascending=False)
+    # Igual que groupby: se omiten productos sin SKU o sin nombre
+    valid = items_df['sku'].notna() & items_df['name'].notna()
+    items_df = items_df[valid]
     
-    # Calcular % del total
-    total_sales = product_summary['line_total'].sum()
-    product_summary['pct_total'] = (product_summary['line_total'] / total_sales * 100).round(2)
+    if items_df.empty:
+        return pd.DataFrame()
     
-    # Top N
-    top_products = product_summary.head(top_n).reset_index(drop=True)
+    # Códigos enteros por columna (como una categoría) en lugar de tuplas de strings
+    sku_codes, skus = pd.factorize(items_df['sku'])
+    name_codes, names = pd.factorize(items_df['name'])
+    
+    # Combinar ambos códigos en un solo entero y asignar un id a cada par (sku, name)
+    pair_codes = sku_codes.astype(np.int64) * len(names) + name_codes
+    codes, pairs = pd.factorize(pair_codes)
+    n_products = len(pairs)
+    
+    # Sumar unidades y ventas por producto en una pasada (bincount corre en C)
+    units = np.bincount(codes, weights=items_df['quantity'].to_numpy(dtype=np.float64), minlength=n_products)
+    sales = np.bincount(codes, weights=items_df['line_total'].to_numpy(dtype=np.float64), minlength=n_products)
+    
+    # Total de ventas sobre todos los productos (el % se calcula solo para el top)
+    total_sales = sales.sum()
+    
+    # Top N: selección parcial y solo se ordena el resultado
+    k = min(top_n, n_products)
+    top_idx = np.argpartition(-sales, k - 1)[:k]
+    top_idx = top_idx[np.argsort(-sales[top_idx], kind='stable')]
+    top_sales = sales[top_idx]
+    
+    top_products = pd.DataFrame({
+        'SKU': skus[pairs[top_idx] // len(names)],
+        'Producto': names[pairs[top_idx] % len(names)],
+        'Unidades': units[top_idx].astype(np.int64),
+        'Ventas (MXN)': top_sales,
+        '% del Total': (top_sales / total_sales * 100).round(2)
+    })
     top_products.index = top_products.index + 1  # Ranking empieza en 1
     
-    # Renombrar columnas
-    top_products.columns = ['SKU', 'Producto', 'Unidades', 'Ventas (MXN)', '% del Total']
-    
     return top_products
 
 def format_product_table(df):
     """
-    Formatea la tabla de productos para display
+    Prepara la tabla de productos para display
+    
+    Las columnas numéricas se dejan sin formato; Streamlit las formatea
+    en el navegador con st.column_config.NumberColumn
     
     Args:
-        df: DataFrame con productos
+        df: DataFrame con productos (no se modifica)
         
     Returns:
-        DataFrame formateado
+        Nuevo DataFrame con columna '#' de ranking
     """
     
     if df.empty:
         return df
     
-    # Formatear columnas numéricas
-    df['Ventas (MXN)'] = df['Ventas (MXN)'].apply(lambda x: f"${x:,.2f}")
-    df['% del Total'] = df['% del Total'].apply(lambda x: f"{x:.1f}%")
-    df['Unidades'] = df['Unidades'].apply(lambda x: f"{int(x):,}")
+    # Agregar columna de ranking (copia superficial: no duplica los datos)
+    display_df = df.copy(deep=False)
+    display_df.insert(0, '#', range(1, len(display_df) + 1))
     
-    return df
\ No newline at end of file
+    return display_df
\ No newline at end of file
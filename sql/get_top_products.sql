@@ -0,0 +1,79 @@
+-- Función con el ranking de productos de un rango de fechas
+-- El tab de Top Productos la llama por RPC en lugar de descargar cada orden
+-- Si la función no existe (o falla), el dashboard procesa los line_items en pandas
+-- Mismos criterios que product_processor: SKU 'N/A' si es nulo y 'Sin nombre' si el nombre es nulo o vacío
+-- processed_at se guarda en UTC sin timezone; se convierte antes de compararlo con timestamptz
+-- Requiere line_items como jsonb: ejecutar antes sql/line_items_jsonb.sql
+-- Siempre regresa al menos una fila con los totales del rango; si no hay productos,
+-- esa fila trae sku/name en null
+
+create or replace function get_top_products(start_ts timestamptz, end_ts timestamptz, top_n int)
+returns table (
+    sku text,
+    name text,
+    units bigint,
+    revenue numeric,
+    pct_total numeric,
+    total_orders bigint,
+    total_items bigint,
+    total_units bigint,
+    total_revenue numeric,
+    unique_skus bigint
+)
+language sql
+stable
+as $$
+    with orders as (
+        select line_items
+        from orders_final
+        where processed_at at time zone 'UTC' between start_ts and end_ts
+    ),
+    items as (
+        select
+            coalesce(li->>'sku', 'N/A') as sku,
+            coalesce(nullif(li->>'name', ''), 'Sin nombre') as name,
+            coalesce((li->>'quantity')::int, 0) as quantity,
+            coalesce((li->>'price')::numeric, 0) * coalesce((li->>'quantity')::int, 0) as line_total
+        from orders,
+            jsonb_array_elements(
+                case when jsonb_typeof(orders.line_items) = 'array' then orders.line_items else '[]'::jsonb end
+            ) as li
+        where jsonb_typeof(li) = 'object'
+    ),
+    products as (
+        select sku, name, sum(quantity)::bigint as units, sum(line_total) as revenue
+        from items
+        group by 1, 2
+    ),
+    ranked as (
+        select sku, name, units, revenue
+        from products
+        order by revenue desc, sku, name
+        limit top_n
+    ),
+    totals as (
+        select
+            (select count(*) from orders) as total_orders,
+            count(*) as total_items,
+            coalesce(sum(quantity), 0)::bigint as total_units,
+            coalesce(sum(line_total), 0) as total_revenue,
+            count(distinct sku) as unique_skus
+        from items
+    )
+    select
+        p.sku,
+        p.name,
+        p.units,
+        p.revenue,
+        round(p.revenue / nullif(t.total_revenue, 0) * 100, 2) as pct_total,
+        t.total_orders,
+        t.total_items,
+        t.total_units,
+        t.total_revenue,
+        t.unique_skus
+    from totals t
+    left join ranked p on true
+    order by p.revenue desc nulls last, p.sku, p.name;
+$$;
+
+grant execute on function get_top_products(timestamptz, timestamptz, int) to anon, authenticated;
@@ -0,0 +1,6 @@
+-- Guardar line_items como jsonb para que PostgREST la regrese ya decodificada
+-- (lista de objetos) y el dashboard no tenga que parsear el JSON otra vez
+-- Solo es necesario si la columna es text; si ya es jsonb no hace nada
+
+alter table orders_final
+    alter column line_items type jsonb using line_items::jsonb;
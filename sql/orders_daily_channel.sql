@@ -0,0 +1,18 @@
+-- Vista con ventas agregadas por día (horario de México) y canal
+-- El overview del dashboard lee esta vista en lugar de descargar cada orden
+-- processed_at se guarda en UTC sin timezone
+
+create or replace view orders_daily_channel as
+select
+    (processed_at at time zone 'UTC' at time zone 'America/Mexico_City')::date as day,
+    case
+        when btrim(channel_tags) in ('Amazon', 'Mercado Libre', 'Shopify', 'TikTok')
+            then btrim(channel_tags)
+        else 'Otro'
+    end as channel,
+    coalesce(sum(total_price::numeric), 0) as sales,
+    count(*) as orders
+from orders_final
+group by 1, 2;
+
+grant select on orders_daily_channel to anon, authenticated;
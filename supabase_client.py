@@ -0,0 +1,11 @@
+"""
+Cliente de Supabase compartido por el dashboard y el script de prueba
+"""
+
+import streamlit as st
+from supabase import create_client, Client
+
+@st.cache_resource(show_spinner=False)
+def get_supabase() -> Client:
+    """Crear el cliente de Supabase una sola vez por proceso (reutiliza sus conexiones HTTP)"""
+    return create_client(st.secrets["SUPABASE_URL"], st.secrets["SUPABASE_KEY"])
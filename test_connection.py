@@ -5,11 +5,11 @@ y estructura de datos antes del deployment
 
 import sys
 from datetime import datetime, timedelta
-import pytz
 
 try:
-    from supabase import create_client
     import pandas as pd
+    from supabase_client import get_supabase
+    from product_processor import parse_line_items
     print("✅ Librerías importadas correctamente")
 except ImportError as e:
     print(f"❌ Error al importar librerías: {e}")
@@ -23,18 +23,23 @@ def test_connection():
     print("="*60)
     
     try:
-        # Intentar leer secrets
+        # Verificar que existan los secrets (get_supabase los lee después)
         import streamlit as st
-        url = st.secrets["SUPABASE_URL"]
-        key = st.secrets["SUPABASE_KEY"]
-        print("✅ Secrets cargados correctamente")
+        missing = [name for name in ("SUPABASE_URL", "SUPABASE_KEY") if name not in st.secrets]
     except Exception as e:
         print(f"❌ Error al cargar secrets: {e}")
         print("\n👉 Asegúrate de tener .streamlit/secrets.toml configurado")
         return False
     
+    if missing:
+        print(f"❌ Faltan secrets: {', '.join(missing)}")
+        print("\n👉 Agrégalos en .streamlit/secrets.toml")
+        return False
+    
+    print("✅ Secrets cargados correctamente")
+    
     try:
-        supabase = create_client(url, key)
+        supabase = get_supabase()
         print("✅ Cliente de Supabase creado")
     except Exception as e:
         print(f"❌ Error al crear cliente: {e}")
@@ -49,9 +54,9 @@ def test_orders_table(supabase):
     print("="*60)
     
     try:
-        # Obtener últimas 5 órdenes
+        # Obtener últimas 5 órdenes (sin line_items, se prueba aparte)
         response = supabase.table('orders_final')\
-            .select('*')\
+            .select('id,order_number,created_at,processed_at,total_price,channel_tags')\
             .order('created_at', desc=True)\
             .limit(5)\
             .execute()
@@ -67,7 +72,7 @@ def test_orders_table(supabase):
         # Verificar columnas importantes
         required_cols = [
             'id', 'order_number', 'created_at', 'processed_at',
-            'total_price', 'channel_tags', 'line_items'
+            'total_price', 'channel_tags'
         ]
         
         missing_cols = [col for col in required_cols if col not in df.columns]
@@ -83,54 +88,80 @@ def test_orders_table(supabase):
         print(f"❌ Error al acceder a orders_final: {e}")
         return False
 
-def test_line_items(df):
+def test_daily_channel_view(supabase):
+    """Probar vista orders_daily_channel"""
+    print("\n" + "="*60)
+    print("📈 PROBANDO VISTA orders_daily_channel")
+    print("="*60)
+    
+    try:
+        response = supabase.table('orders_daily_channel')\
+            .select('day,channel,sales,orders')\
+            .order('day', desc=True)\
+            .limit(5)\
+            .execute()
+        
+        if not response.data:
+            print("⚠️  La vista está vacía")
+            return False
+        
+        print(f"✅ Vista encontrada ({len(response.data)} filas de muestra)")
+        for row in response.data:
+            print(f"   - {row['day']} | {row['channel']}: {row['orders']} órdenes")
+        
+        return True
+        
+    except Exception as e:
+        print(f"❌ Error al acceder a orders_daily_channel: {e}")
+        print("\n👉 Ejecuta sql/orders_daily_channel.sql en el SQL editor de Supabase")
+        return False
+
+def test_line_items(supabase):
     """Probar extracción de line_items"""
     print("\n" + "="*60)
     print("📦 PROBANDO LINE_ITEMS")
     print("="*60)
     
-    if 'line_items' not in df.columns:
-        print("❌ Columna line_items no existe")
+    try:
+        # Traer solo una orden con line_items
+        response = supabase.table('orders_final')\
+            .select('line_items')\
+            .not_.is_('line_items', 'null')\
+            .limit(1)\
+            .execute()
+    except Exception as e:
+        print(f"❌ Error al consultar line_items: {e}")
         return False
     
-    # Contar órdenes con line_items
-    has_items = df['line_items'].notna().sum()
-    total = len(df)
-    pct = (has_items / total * 100) if total > 0 else 0
-    
-    print(f"📊 {has_items}/{total} órdenes tienen line_items ({pct:.1f}%)")
-    
-    if has_items == 0:
+    if not response.data:
         print("❌ Ninguna orden tiene line_items")
         print("\n👉 Asegúrate de que tu API está guardando line_items en formato JSON")
         return False
     
-    # Probar parsear un line_item
-    import json
-    for idx, row in df.iterrows():
-        if pd.notna(row['line_items']):
-            try:
-                if isinstance(row['line_items'], str):
-                    items = json.loads(row['line_items'])
-                elif isinstance(row['line_items'], list):
-                    items = row['line_items']
-                else:
-                    continue
-                
-                if items:
-                    print(f"✅ Line items parseados correctamente")
-                    print(f"   Ejemplo de producto:")
-                    print(f"   - SKU: {items[0].get('sku', 'N/A')}")
-                    print(f"   - Nombre: {items[0].get('name', 'N/A')}")
-                    print(f"   - Cantidad: {items[0].get('quantity', 0)}")
-                    print(f"   - Precio: {items[0].get('price', 0)}")
-                    return True
-            except json.JSONDecodeError:
-                print("⚠️  Line items no es JSON válido")
-                continue
-    
-    print("⚠️  No se pudieron parsear line_items")
-    return False
+    # Mismo parser que usa el dashboard (lista JSONB o texto JSON)
+    raw = response.data[0]['line_items']
+    items = parse_line_items(raw)
+    
+    if items is None:
+        print("⚠️  Line items no es JSON válido")
+        return False
+    
+    if not items:
+        print("⚠️  No se pudieron parsear line_items")
+        return False
+    
+    print(f"✅ Line items parseados correctamente")
+    if isinstance(raw, list):
+        print("✅ line_items llega como lista (JSONB), no requiere parseo")
+    else:
+        print("⚠️  line_items llega como texto; el dashboard lo parsea en cada carga")
+        print("   👉 Ejecuta sql/line_items_jsonb.sql para guardarlo como jsonb")
+    print(f"   Ejemplo de producto:")
+    print(f"   - SKU: {items[0].get('sku', 'N/A')}")
+    print(f"   - Nombre: {items[0].get('name', 'N/A')}")
+    print(f"   - Cantidad: {items[0].get('quantity', 0)}")
+    print(f"   - Precio: {items[0].get('price', 0)}")
+    return True
 
 def test_channels(df):
     """Probar distribución de canales"""
@@ -191,13 +222,16 @@ def main():
         print("\n❌ PRUEBAS FALLIDAS - Problema con tabla orders_final")
         return
     
-    # Test 3: Line items
-    test_line_items(df)
+    # Test 3: Vista agregada
+    test_daily_channel_view(supabase)
+    
+    # Test 4: Line items
+    test_line_items(supabase)
     
-    # Test 4: Canales
+    # Test 5: Canales
     test_channels(df)
     
-    # Test 5: Fechas
+    # Test 6: Fechas
     test_dates(df)
     
     print("\n" + "="*60)